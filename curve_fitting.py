@@ -1,5 +1,7 @@
+import numpy as np
 from sympy.polys.specialpolys import interpolating_poly
 from sympy.abc import x
+from linear_system import solve_tridiag
 
 #fit n+1 data points to a function contains m+1 variable parameters
 # n=m -> interpolation
@@ -50,3 +52,51 @@ def interpolating_poly_Neville(n, symbol, X, Y):
     for i in range(1, n):
         poly[0:n-i] = ((symbol - X[i:n])*poly[0:n-i]+(X[0:n-i] - symbol)*poly[1:n-i+1])/(X[0:n-i] - X[i:n])
     return poly[0]
+
+def curvatures_cubic_spline(X, Y):
+    """
+    second derivatives k[i] of the natural cubic spline through (X, Y)
+    the tridiagonal system for interior knots is solved in O(n) with solve_tridiag
+    X, Y can carry leading batch axes to fit many curves on their own knots at once
+    """
+    X = np.asarray(X, dtype = float)
+    Y = np.asarray(Y, dtype = float)
+    h = X[..., :-1] - X[..., 1:]
+    s = (Y[..., :-1] - Y[..., 1:])/h
+    k = np.zeros(np.broadcast(X, Y).shape)
+    k[..., 1:-1] = solve_tridiag(a = h[..., :-1], d = 2.0*(h[..., :-1] + h[..., 1:]), c = h[..., 1:], b = 6.0*(s[..., :-1] - s[..., 1:]))
+    return k
+
+def eval_cubic_spline(X, Y, k, x):
+    """
+    evaluate the cubic spline with curvatures k (see curvatures_cubic_spline) at points x
+    X, Y, k and x can carry leading batch axes that broadcast against each other,
+    e.g. many curves Y (N x n) on shared knots X (n,) evaluated at shared points x (m,)
+    """
+    X = np.asarray(X, dtype = float)
+    Y = np.asarray(Y, dtype = float)
+    k = np.asarray(k, dtype = float)
+    x = np.asarray(x, dtype = float)
+    scalar = x.ndim == 0
+    x = np.atleast_1d(x)
+    n = X.shape[-1]
+    if X.ndim == 1:
+        i = np.searchsorted(X, x)
+    else:
+        i = (X[..., np.newaxis, :] < x[..., np.newaxis]).sum(axis = -1)
+    i = np.clip(i - 1, 0, n - 2)
+    x0, x1 = _take_knots(X, i), _take_knots(X, i+1)
+    h = x0 - x1
+    y = ((x - x1)**3/h - (x - x1)*h)*_take_knots(k, i)/6.0 - ((x - x0)**3/h - (x - x0)*h)*_take_knots(k, i+1)/6.0 \
+        + (_take_knots(Y, i)*(x - x1) - _take_knots(Y, i+1)*(x - x0))/h
+    return y[..., 0] if scalar else y
+
+def _take_knots(A, i):
+    """
+    A[..., i] along the knot axis, batch axes of A and i broadcast
+    """
+    nd = max(A.ndim, i.ndim)
+    A = A.reshape((1,)*(nd - A.ndim) + A.shape)
+    i = i.reshape((1,)*(nd - i.ndim) + i.shape)
+    shape = np.broadcast(A[..., :1], i[..., :1]).shape[:-1]
+    return np.take_along_axis(np.broadcast_to(A, shape + A.shape[-1:]), np.broadcast_to(i, shape + i.shape[-1:]), axis = -1)
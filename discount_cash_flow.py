@@ -9,27 +9,162 @@ select the project with the greatest NPV when the IRR and NPV rules provide conf
 """
 
 import numpy as np
-from scipy.optimize import newton
+
+_DF_CACHE = {}
+_DF_CACHE_SIZE = 32
+
+class CashFlowSchedule(object):
+    """
+    cash flows compiled once into a dense per-period amount array
+
+    takes the same arguments as npv: cf0 at time 0, then one flow per period;
+    a tuple (lag, cf, frq) is an annuity segment paying cf for frq periods,
+    the first payment lag periods after the slot the tuple occupies
+    """
+    def __init__(self, cf0, *args):
+        periods = [0]
+        amounts = [cf0]
+        i = 1
+        for arg in args:
+            if isinstance(arg, tuple):
+                lag, _cf, frq = arg
+                periods.extend(range(i + lag, i + lag + frq))
+                amounts.extend([_cf] * frq)
+                i += (lag + frq - 1)
+            else:
+                periods.append(i)
+                amounts.append(arg)
+            i += 1
+        self.periods = np.asarray(periods, dtype = np.int64)
+        self.amounts = np.asarray(amounts, dtype = np.float64)
+        self.cf = np.bincount(self.periods, weights = self.amounts)
+
+    def npv(self, r):
+        """
+        npv at one rate or an array of rates through the cached discount factors
+        """
+        rates = np.asarray(r, dtype = np.float64)
+        df = discount_factors(rates.ravel(), len(self.cf))
+        return np.dot(df, self.cf).reshape(rates.shape)[()]
+
+    def irr(self):
+        r, nit, converged = irr_batch(self.cf)
+        if not converged[0]:
+            raise RuntimeError('irr failed to converge')
+        return r[0]
+
+def discount_factors(rates, n):
+    """
+    (rates x periods) matrix of 1/(1+r)^i for i in range(n)
+    cached by rates, wider tables are sliced for shorter schedules;
+    the returned table is a read-only view of the cache
+    """
+    rates = np.asarray(rates, dtype = np.float64).ravel()
+    key = rates.tobytes()
+    df = _DF_CACHE.get(key)
+    if df is None or df.shape[1] < n:
+        if len(_DF_CACHE) >= _DF_CACHE_SIZE:
+            _DF_CACHE.pop(next(iter(_DF_CACHE)))
+        df = np.power(1 + rates[:, np.newaxis], -np.arange(n, dtype = np.float64))
+        df.flags.writeable = False
+        _DF_CACHE[key] = df
+    return df[:, :n]
 
 def npv(r, cf0, *args):
-    from time_value_money import _sumgs
-    npv = cf0
-    i = 1
-    for arg in args:
-        if isinstance(arg, tuple):
-            lag, _cf, frq = arg
-            cf = _sumgs(r = r, n = frq, a1 = _cf)
-            i += (lag + frq - 1)
-        else:
-            cf = arg
-        npv += cf/np.power(1+r, i)
-        i += 1
-    return npv
+    return CashFlowSchedule(cf0, *args).npv(r)
 
 def irr(cf0, *args):
-    def func(r):
-        return npv(r, cf0, *args)
-    return newton(func, 0.05)
+    return CashFlowSchedule(cf0, *args).irr()
+
+def irr_batch(cf, guess = 0.05, tol = 1e-10, maxiter = 50, bracket = (-0.99, 10.), ngrid = 64):
+    """
+    solve the IRR of every row of a (projects x periods) cash flow matrix at once
+    cf[:, 0] is the time-0 flow, cf[:, i] is received at the end of period i
+
+    Halley steps with analytic first and second derivatives of npv are taken
+    for all rows together; rows that stall, leave the domain r > -1 or do not
+    converge within maxiter are re-solved by bisection on the first sign change
+    of npv found on a grid over bracket
+
+    returns
+    -------
+    r: irr per row, nan where no root was found
+    nit: iterations taken per row
+    converged: bool per row
+    """
+    cf = np.atleast_2d(np.asarray(cf, dtype = np.float64))
+    m, n = cf.shape
+    t = np.arange(n, dtype = np.float64)
+    r = np.full(m, guess, dtype = np.float64)
+    nit = np.zeros(m, dtype = np.int64)
+    converged = np.zeros(m, dtype = bool)
+    active = np.ones(m, dtype = bool)
+    for k in range(maxiter):
+        idx = np.flatnonzero(active)
+        if not idx.size:
+            break
+        f, f1, f2 = _npv_derivs(cf[idx], t, r[idx])
+        with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+            step = 2*f*f1 / (2*f1*f1 - f*f2)
+            rn = r[idx] - step
+            bad = ~np.isfinite(rn) | (rn <= -1)
+            done = ~bad & (np.abs(step) <= tol*(1 + np.abs(rn)))
+        nit[idx] += 1
+        r[idx[~bad]] = rn[~bad]
+        converged[idx[done]] = True
+        active[idx[done | bad]] = False
+    idx = np.flatnonzero(~converged)
+    if idx.size:
+        rb, nb, cb = _irr_bisect(cf[idx], t, bracket, ngrid, tol)
+        r[idx] = rb
+        nit[idx] += nb
+        converged[idx] = cb
+    return r, nit, converged
+
+def _npv_derivs(cf, t, r):
+    """
+    npv and its first two derivatives wrt r for each row of cf
+    """
+    g = 1 + r[:, np.newaxis]
+    with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+        d = cf * np.power(g, -t)
+        f = d.sum(axis = 1)
+        f1 = -(d*t).sum(axis = 1) / g[:, 0]
+        f2 = (d*t*(t+1)).sum(axis = 1) / (g[:, 0]*g[:, 0])
+    return f, f1, f2
+
+def _irr_bisect(cf, t, bracket, ngrid, tol):
+    """
+    bracketing fallback of irr_batch: bisection on the first sign change
+    long schedules overflow near the lower bracket, those grid points are
+    nan and never count as a sign change
+    """
+    m = len(cf)
+    grid = np.linspace(bracket[0], bracket[1], ngrid)
+    with np.errstate(over = 'ignore', invalid = 'ignore'):
+        fg = np.dot(cf, np.power(1 + grid[np.newaxis, :], -t[:, np.newaxis]))
+        fg[~np.isfinite(fg)] = np.nan
+        change = np.sign(fg[:, :-1]) * np.sign(fg[:, 1:]) <= 0
+    found = change.any(axis = 1)
+    j = np.argmax(change, axis = 1)
+    lo, hi = grid[j], grid[j+1]
+    flo = fg[np.arange(m), j]
+    nit = np.zeros(m, dtype = np.int64)
+    rows = np.flatnonzero(found)
+    for k in range(200):
+        if not rows.size:
+            break
+        mid = 0.5*(lo[rows] + hi[rows])
+        with np.errstate(over = 'ignore', invalid = 'ignore'):
+            fmid = (cf[rows] * np.power(1 + mid[:, np.newaxis], -t)).sum(axis = 1)
+        left = np.sign(fmid) == np.sign(flo[rows])
+        lo[rows] = np.where(left, mid, lo[rows])
+        flo[rows] = np.where(left, fmid, flo[rows])
+        hi[rows] = np.where(left, hi[rows], mid)
+        nit[rows] += 1
+        rows = rows[(hi[rows] - lo[rows]) > tol*(1 + np.abs(lo[rows]))]
+    r = np.where(found, 0.5*(lo + hi), np.nan)
+    return r, nit, found
 
 def hpy2bey(mat, hpy):
     """bond equivalent yield: semiannual discount rate
@@ -1,3 +1,4 @@
+import multiprocessing
 import numpy as np
 import scipy.stats as st
 """
@@ -47,10 +48,10 @@ def test_1samp_raw(a, popmean, sig = None, popstd = False, normal = True, tail =
     return test_1samp(a = avg, popmean = popmean, std = std, n = n, sig = sig, popstd = popstd, normal = normal, tail = tail, thresz = thresz)
 
 def test_1samp(a, popmean, std, n, sig = None, popstd = False, normal = True, tail = 2, thresz = 30):
-    if n < thresz and not normal:
-        raise Exception("Test for non-normal small sample not applicable")
+    if np.any(np.asarray(n) < thresz) and not normal:
+        raise Exception("Test for non-normal small sample not applicable, see test_1samp_boot")
     d = a - popmean
-    denom = np.divide(std, np.sqrt(float(n)))
+    denom = np.divide(std, np.sqrt(np.asarray(n, dtype = np.float64)))
     x = np.divide(d, denom)
     if popstd:
         p = pscore(x = x, tail = tail, test = 'z')
@@ -60,7 +61,12 @@ def test_1samp(a, popmean, std, n, sig = None, popstd = False, normal = True, ta
     return decirule(x, p, sig)
 
 def decirule(x, p, sig = None):
+    """
+    scalar p returns a single decision, array p an array of decisions
+    """
     if sig:
+        if np.ndim(p):
+            return x, p, np.where(np.asarray(p) < sig, 'reject', 'cannot reject')
         if p < sig:
             return x, p, 'reject'
         else:
@@ -68,35 +74,43 @@ def decirule(x, p, sig = None):
     else:
         return x, p
 
-def pscore(x, tail = 2, df = None, df2 = None, test = 't'):
-    if tail == 2:
-        x = np.abs(x)
-    if not df:
-        print "z test"
+def pscore(x, tail = 2, df = None, df2 = None, test = 't', verbose = False):
+    """
+    p-values of one test family for a scalar or an array of statistics
+    x, tail, df and df2 broadcast against each other,
+    sf and cdf are each evaluated at most once per call
+    """
+    tail = np.asarray(tail)
+    x = np.where(tail == 2, np.abs(x), x)
+    if df is None:
+        name = "z test"
         dist = st.norm
         args = x,
     elif test == 't':
-        print "t test"
+        name = "t test"
         dist = st.t
         args = x, df
     elif test == 'chi2':
-        print "chi square test"
+        name = "chi square test"
         dist = st.chi2
         args = x, df
     elif test == 'f':
-        print "f test"
+        name = "f test"
         dist = st.f
         args = x, df, df2
-    if tail == 2:
-        print "2 sided"
-        p = min(dist.sf(*args)*2, 1)
-    if tail == -1:
-        print "left tail"
-        p = dist.cdf(*args)
-    if tail == 1:
-        print "right tail"
+    if verbose:
+        print(name)
+        print({2: "2 sided", -1: "left tail", 1: "right tail"}.get(tail.item() if not tail.ndim else None, "mixed tails"))
+    if (tail == 2).all():
+        p = np.minimum(dist.sf(*args)*2, 1)
+    elif (tail == 1).all():
         p = dist.sf(*args)
-    return p
+    elif (tail == -1).all():
+        p = dist.cdf(*args)
+    else:
+        sf = dist.sf(*args)
+        p = np.select([tail == 2, tail == 1, tail == -1], [np.minimum(sf*2, 1), sf, dist.cdf(*args)], np.nan)
+    return np.asarray(p)[()]
 
 def test_corr(corr, n, sig = None, tail = 2):
     df = n - 2
@@ -110,7 +124,7 @@ def test_ind_raw(a1, a2, dmean = 0, sig = None, eqvar = True, tail = 2):
     avg1 = np.mean(a1)
     avg2 = np.mean(a2)
     var1 = np.var(a1, ddof = 1)
-    var2 = np.var(a2, ddof = 2)
+    var2 = np.var(a2, ddof = 1)
     return test_ind(a1 = avg1, a2 = avg2, var1 = var1, var2 = var2, n1 = n1, n2 = n2, dmean = dmean, sig = sig, eqvar = eqvar, tail = tail)
 
 def test_ind(a1, a2, var1, var2, n1, n2, dmean = 0, sig = None, eqvar = True, tail = 2):
@@ -118,14 +132,14 @@ def test_ind(a1, a2, var1, var2, n1, n2, dmean = 0, sig = None, eqvar = True, ta
     if eqvar:
         # pooled variance
         df = n1 + n2 - 2
-        varp = np.divide(((n1 - 1) * var1 + (n2 - 1) * var2), float(df))
-        denom = np.sqrt(np.divide(varp, float(n1)) + np.divide(varp, float(n2)))
+        varp = np.divide(((n1 - 1) * var1 + (n2 - 1) * var2), np.asarray(df, dtype = np.float64))
+        denom = np.sqrt(np.divide(varp, np.asarray(n1, dtype = np.float64)) + np.divide(varp, np.asarray(n2, dtype = np.float64)))
     else:
         # Welch's test
-        vn1 = np.divide(var1, float(n1))
-        vn2 = np.divide(var2, float(n2))
+        vn1 = np.divide(var1, np.asarray(n1, dtype = np.float64))
+        vn2 = np.divide(var2, np.asarray(n2, dtype = np.float64))
         varp = vn1 + vn2
-        df = np.divide(np.power(varp, 2), np.divide(np.power(vn1, 2), n1-1) + np.divide(np.power(vn2, 2), n2-2))
+        df = np.divide(np.power(varp, 2), np.divide(np.power(vn1, 2), n1-1) + np.divide(np.power(vn2, 2), n2-1))
         denom = np.sqrt(varp)
     x = np.divide(d, denom)
     p = pscore(x = x, tail = tail, df = df)
@@ -133,13 +147,220 @@ def test_ind(a1, a2, var1, var2, n1, n2, dmean = 0, sig = None, eqvar = True, ta
 
 def test_rel_raw(a1, a2, dmean = 0, sig = None, tail = 2, thresz = 30):
     n = len(a1)
-    if n != len(b2):
+    if n != len(a2):
         raise ValueError('input arrays with different lengths')
     d = (a1 - a2).astype(np.float64)
     avg = np.mean(d)
     std = np.std(d, ddof = 1)
     return test_1samp(a = avg, popmean = dmean, std = std, n = n, sig = sig, popstd = False, normal = True, tail = tail, thresz = thresz)
 
+def test_1samp_mat(a, popmean, sig = None, normal = True, tail = 2, thresz = 30, axis = 0):
+    """
+    one sample t-test of every column (axis = 0) of a returns panel at once
+    nan entries are masked out column by column
+    """
+    n, avg, var = _moments(a, axis = axis)
+    return test_1samp(a = avg, popmean = popmean, std = np.sqrt(var), n = n, sig = sig, normal = normal, tail = tail, thresz = thresz)
+
+def test_ind_mat(a1, a2, dmean = 0, sig = None, eqvar = True, tail = 2, axis = 0):
+    """
+    independent samples t-test column by column of 2 panels
+    panels may differ in length along axis
+    """
+    n1, avg1, var1 = _moments(a1, axis = axis)
+    n2, avg2, var2 = _moments(a2, axis = axis)
+    return test_ind(a1 = avg1, a2 = avg2, var1 = var1, var2 = var2, n1 = n1, n2 = n2, dmean = dmean, sig = sig, eqvar = eqvar, tail = tail)
+
+def test_rel_mat(a1, a2, dmean = 0, sig = None, tail = 2, thresz = 30, axis = 0):
+    """
+    paired t-test column by column of 2 panels of the same shape
+    pairs with a nan on either side are dropped
+    """
+    if np.shape(a1) != np.shape(a2):
+        raise ValueError('input arrays with different shapes')
+    d = np.asarray(a1, dtype = np.float64) - np.asarray(a2, dtype = np.float64)
+    n, avg, var = _moments(d, axis = axis)
+    return test_1samp(a = avg, popmean = dmean, std = np.sqrt(var), n = n, sig = sig, popstd = False, normal = True, tail = tail, thresz = thresz)
+
+def _moments(a, axis = 0):
+    """
+    nan-aware count, mean and sample variance along axis in a single pass
+    sums are shifted by the first row to limit cancellation
+    """
+    a = np.asarray(a, dtype = np.float64)
+    mask = ~np.isnan(a)
+    k = np.nan_to_num(np.take(a, [0], axis = axis))
+    x = np.where(mask, a - k, 0.)
+    n = mask.sum(axis = axis)
+    s1 = x.sum(axis = axis)
+    s2 = (x*x).sum(axis = axis)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        avg = np.squeeze(k, axis = axis) + s1 / n
+        var = (s2 - s1*s1 / n) / (n - 1)
+    return n, avg, var
+
+class MomentAccumulator(object):
+    """
+    running count, mean and central moment sums M2, M3, M4 of a stream
+    chunks are ingested along axis 0, trailing axes are tracked column-wise;
+    accumulators of different shards merge exactly (Chan / Pebay formulas),
+    and the test statistics are emitted through the test_* functions
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = self.m2 = self.m3 = self.m4 = 0.
+
+    def update(self, x):
+        x = np.asarray(x, dtype = np.float64)
+        if not len(x):
+            return self
+        other = MomentAccumulator()
+        other.n = len(x)
+        other.mean = x.mean(axis = 0)
+        d = x - other.mean
+        d2 = d*d
+        other.m2 = d2.sum(axis = 0)
+        other.m3 = (d2*d).sum(axis = 0)
+        other.m4 = (d2*d2).sum(axis = 0)
+        return self.merge(other)
+
+    def merge(self, other):
+        na, nb = self.n, other.n
+        if not nb:
+            return self
+        if not na:
+            self.n, self.mean, self.m2, self.m3, self.m4 = other.n, other.mean, other.m2, other.m3, other.m4
+            return self
+        n = float(na + nb)
+        delta = other.mean - self.mean
+        d2 = delta*delta
+        m4 = self.m4 + other.m4 + d2*d2*na*nb*(na*na - na*nb + nb*nb) / (n*n*n) \
+            + 6*d2*(na*na*other.m2 + nb*nb*self.m2) / (n*n) + 4*delta*(na*other.m3 - nb*self.m3) / n
+        m3 = self.m3 + other.m3 + d2*delta*na*nb*(na - nb) / (n*n) + 3*delta*(na*other.m2 - nb*self.m2) / n
+        self.m2 = self.m2 + other.m2 + d2*na*nb / n
+        self.mean = self.mean + delta*nb / n
+        self.m3, self.m4 = m3, m4
+        self.n = na + nb
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1.)
+
+    @property
+    def skew(self):
+        return np.sqrt(self.n) * self.m3 / np.power(self.m2, 1.5)
+
+    @property
+    def ex_kurt(self):
+        return self.n * self.m4 / (self.m2*self.m2) - 3
+
+    def test_1samp(self, popmean, sig = None, normal = True, tail = 2, thresz = 30):
+        return test_1samp(a = self.mean, popmean = popmean, std = np.sqrt(self.var), n = self.n, sig = sig, normal = normal, tail = tail, thresz = thresz)
+
+    def test_chi2(self, popvar, sig = None, tail = 2):
+        return test_chi2(var = self.var, popvar = popvar, n = self.n, sig = sig, tail = tail)
+
+    def test_f(self, other, sig = None, tail = 1):
+        return test_f(var1 = self.var, var2 = other.var, n1 = self.n, n2 = other.n, sig = sig, tail = tail)
+
+    def test_jb(self, sig = None):
+        return test_jb(skew = self.skew, ex_kurt = self.ex_kurt, n = self.n, sig = sig)
+
+def test_1samp_boot(a, popmean, sig = None, tail = 2, nresample = 10000, batch = 1000, seed = None, workers = 1, conf = .99):
+    """
+    studentized bootstrap one sample test for non-normal small samples
+    the sample is recentered on popmean and resampled with replacement
+    """
+    a = np.asarray(a, dtype = np.float64)
+    n = len(a)
+    x = (a.mean() - popmean) / (a.std(ddof = 1) / np.sqrt(n))
+    data = a - a.mean() + popmean, popmean
+    return _resample_test(_boot_1samp, data, x, sig, tail, nresample, batch, seed, workers, conf)
+
+def test_ind_perm(a1, a2, dmean = 0, sig = None, tail = 2, nresample = 10000, batch = 1000, seed = None, workers = 1, conf = .99):
+    """
+    permutation test of the difference in means of 2 independent samples
+    """
+    a1 = np.asarray(a1, dtype = np.float64) - dmean
+    a2 = np.asarray(a2, dtype = np.float64)
+    x = a1.mean() - a2.mean()
+    data = np.concatenate((a1, a2)), len(a1)
+    return _resample_test(_perm_ind, data, x, sig, tail, nresample, batch, seed, workers, conf)
+
+def test_rel_perm(a1, a2, dmean = 0, sig = None, tail = 2, nresample = 10000, batch = 1000, seed = None, workers = 1, conf = .99):
+    """
+    sign-flip permutation test of the mean of paired differences
+    """
+    if len(a1) != len(a2):
+        raise ValueError('input arrays with different lengths')
+    d = np.asarray(a1, dtype = np.float64) - np.asarray(a2, dtype = np.float64) - dmean
+    return _resample_test(_perm_rel, d, d.mean(), sig, tail, nresample, batch, seed, workers, conf)
+
+def _resample_test(func, data, x, sig, tail, nresample, batch, seed, workers, conf):
+    """
+    resampling engine shared by the permutation and bootstrap tests
+
+    func(rng, data, size) returns size resampled statistics at once
+    batches run on streams seeded by (seed, batch index) in rounds of one batch
+    per worker and are tallied in order, so the result does not depend on
+    the pool size; with sig set, stops once the conf interval of the p-value
+    excludes sig
+    """
+    nbatch = -(-nresample // batch)
+    seed = _base_seed(seed)
+    jobs = [(func, data, x, tail, (seed, i), min(batch, nresample - i*batch)) for i in range(nbatch)]
+    z = st.norm.ppf(0.5 + conf/2.)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    hits = total = 0
+    done = False
+    try:
+        for i in range(0, nbatch, max(workers, 1)):
+            rnd = jobs[i:i + max(workers, 1)]
+            counts = pool.map(_resample_batch, rnd) if pool else [_resample_batch(job) for job in rnd]
+            for job, k in zip(rnd, counts):
+                hits += k
+                total += job[-1]
+                p = (hits + 1.) / (total + 1.)
+                half = z * np.sqrt(p*(1 - p) / total)
+                if sig and (p + half < sig or p - half > sig):
+                    done = True
+                    break
+            if done:
+                break
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return decirule(x, p, sig)
+
+def _resample_batch(job):
+    """
+    number of resampled statistics at least as extreme as x
+    """
+    func, data, x, tail, (seed, i), size = job
+    s = func(_chunk_rng(seed, i), data, size)
+    if tail == 2:
+        return np.count_nonzero(np.abs(s) >= np.abs(x))
+    elif tail == 1:
+        return np.count_nonzero(s >= x)
+    return np.count_nonzero(s <= x)
+
+def _boot_1samp(rng, data, size):
+    a, popmean = data
+    n = len(a)
+    s = a[rng.randint(0, n, (size, n))]
+    return (s.mean(axis = 1) - popmean) / (s.std(axis = 1, ddof = 1) / np.sqrt(n))
+
+def _perm_ind(rng, data, size):
+    z, n1 = data
+    s = z[np.argsort(rng.random_sample((size, len(z))), axis = 1)]
+    return s[:, :n1].mean(axis = 1) - s[:, n1:].mean(axis = 1)
+
+def _perm_rel(rng, d, size):
+    signs = 2*rng.randint(0, 2, (size, len(d))) - 1
+    return np.dot(signs, d) / len(d)
+
 def test_chi2_raw(a, popvar, sig = None, tail = 2):
     n = len(a)
     var = np.var(a, ddof = 1)
@@ -147,7 +368,7 @@ def test_chi2_raw(a, popvar, sig = None, tail = 2):
 
 def test_chi2(var, popvar, n, sig = None, tail = 2):
     df = n - 1
-    x = np.divide(float(df)*var, popvar)
+    x = np.divide(np.asarray(df, dtype = np.float64)*var, popvar)
     p = pscore(x = x, tail = tail, df = df, test = 'chi2')
     return decirule(x, p, sig)
 
@@ -165,13 +386,110 @@ def test_f_raw(a1, a2, sig = None, tail = 1):
 
 def test_f(var1, var2, n1, n2, sig = None, tail = 1):
     df1, df2 = n1 - 1, n2 - 1
-    if var1 > var2:
+    if np.ndim(var1) or np.ndim(var2):
+        big = np.asarray(var1) > np.asarray(var2)
+        vn, vd = np.where(big, var1, var2), np.where(big, var2, var1)
+        dfn, dfd = np.where(big, df1, df2), np.where(big, df2, df1)
+    elif var1 > var2:
         vn, vd, dfn, dfd = var1, var2, df1, df2
     else:
         vn, vd, dfn, dfd = var2, var1, df2, df1
     x = np.divide(vn, vd)
     p = pscore(x = x, tail = tail, df = dfn, df2 = dfd, test = 'f')
     return decirule(x, p, sig)
+
+class MonteCarlo(object):
+    """
+    streaming Monte Carlo estimate of a simulated outcome
+    e.g. portfolio pnl for var, strategy pnl, pension surplus
+
+    func(rng, size) draws size outcomes from a numpy.random.RandomState
+    paths are simulated chunk by chunk, each chunk on its own stream seeded
+    by (seed, chunk index), so results are reproducible and do not depend on
+    the number of workers; only running moments and a fixed-bin histogram
+    (bins set from the first chunk) are kept, never the paths, and every
+    chunk is merged into them as soon as it arrives
+    func has to be picklable (module level) when workers > 1
+    """
+    def __init__(self, func, nsim, chunk = 100000, seed = None, workers = 1, nbins = 10000):
+        self.func = func
+        self.nsim = nsim
+        self.chunk = chunk
+        self.seed = seed
+        self.workers = workers
+        self.nbins = nbins
+
+    def run(self):
+        sizes = [self.chunk] * (self.nsim // self.chunk)
+        if self.nsim % self.chunk:
+            sizes.append(self.nsim % self.chunk)
+        seed = _base_seed(self.seed)
+        first = np.asarray(self.func(_chunk_rng(seed, 0), sizes[0]), dtype = np.float64)
+        lo, hi = first.min(), first.max()
+        pad = 0.5*(hi - lo) or 1.
+        edges = np.linspace(lo - pad, hi + pad, self.nbins + 1)
+        acc, counts, vmin, vmax = _mc_summary(first, edges)
+        jobs = ((self.func, (seed, i), size, edges) for i, size in enumerate(sizes[1:], 1))
+        pool = multiprocessing.Pool(self.workers) if self.workers > 1 else None
+        try:
+            chunks = pool.imap(_mc_chunk, jobs) if pool else (_mc_chunk(job) for job in jobs)
+            for sacc, scounts, smin, smax in chunks:
+                acc.merge(sacc)
+                counts += scounts
+                vmin, vmax = min(vmin, smin), max(vmax, smax)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.moments = acc
+        self.n, self.mean = acc.n, acc.mean
+        self.var = acc.var
+        self.std = np.sqrt(self.var)
+        self.se = self.std / np.sqrt(self.n)
+        self.counts, self.edges = counts, edges
+        self.min, self.max = vmin, vmax
+        return self
+
+    def quantile(self, q):
+        """
+        quantiles interpolated from the running histogram,
+        tails beyond the bins are stretched to the observed min and max
+        """
+        edges = self.edges.copy()
+        edges[0] = min(edges[0], self.min)
+        edges[-1] = max(edges[-1], self.max)
+        cdf = np.concatenate(([0.], np.cumsum(self.counts))) / float(self.n)
+        return np.interp(q, cdf, edges)
+
+    def test(self, popmean, sig = None, tail = 2):
+        """
+        test the simulated mean through test_1samp
+        """
+        return test_1samp(a = self.mean, popmean = popmean, std = self.std, n = self.n, sig = sig, tail = tail)
+
+def _mc_chunk(job):
+    func, (seed, i), size, edges = job
+    return _mc_summary(np.asarray(func(_chunk_rng(seed, i), size), dtype = np.float64), edges)
+
+def _base_seed(seed):
+    """
+    a fresh base seed when none is given, drawn once per run
+    """
+    return np.random.randint(2**31) if seed is None else seed
+
+def _chunk_rng(seed, i):
+    """
+    independent RandomState of chunk i, seeded by the pair (seed, i)
+    """
+    return np.random.RandomState([seed, i])
+
+def _mc_summary(x, edges):
+    """
+    moments, histogram, min and max of a chunk
+    """
+    counts = np.histogram(np.clip(x, edges[0], edges[-1]), bins = edges)[0]
+    return MomentAccumulator().update(x), counts, x.min(), x.max()
+
 """
 data-mining bias:
     out-of-sample test to avoid
@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 from sympy import pprint, symbols, Eq
 from sympy.abc import sigma, rho, X, P
@@ -60,6 +61,42 @@ def demo_symetricA_Msquare(A):
     print "\nthen A = M*M:\n"
     pprint(q*d*d*q.inv())
 
+_EIG_CACHE = {}
+_EIG_CACHE_SIZE = 16
+
+def eigen_sym(A):
+    """
+    numeric eigen decomposition A = Q * diag(w) * Q' of a symmetric matrix
+    or a stack (..., n, n), Q orthonormal (Q.inv() == Q.T)
+    cached by a hash of A, returned arrays are read-only
+    """
+    return _eig_cached('eigh', A, np.linalg.eigh)
+
+def sqrtm_sym(A):
+    """
+    symmetric square root M = Q * Droot * Q' with M*M = A, numeric version of
+    demo_symetricA_Msquare; tiny negative eigen values from rounding are
+    clipped at 0, stacks (..., n, n) are handled in one call
+    cached by a hash of A, the result is read-only
+    """
+    def sqrtm(A):
+        w, Q = eigen_sym(A)
+        return np.matmul(Q * np.sqrt(np.maximum(w, 0.))[..., np.newaxis, :], np.swapaxes(Q, -1, -2))
+    return _eig_cached('sqrtm', A, sqrtm)
+
+def _eig_cached(kind, A, func):
+    A = np.ascontiguousarray(A, dtype = float)
+    key = (kind, A.shape, hashlib.sha1(A.tobytes()).hexdigest())
+    rst = _EIG_CACHE.get(key)
+    if rst is None:
+        if len(_EIG_CACHE) >= _EIG_CACHE_SIZE:
+            _EIG_CACHE.pop(next(iter(_EIG_CACHE)))
+        rst = func(A)
+        for v in (rst if isinstance(rst, tuple) else (rst,)):
+            v.flags.writeable = False
+        _EIG_CACHE[key] = rst
+    return rst
+
 def demo_eigen_number():
     m = Matrix(3,3,[2,1,0,0,2,1,0,0,2])
     pprint(m)
@@ -131,6 +168,120 @@ def vcv2corr(vcv):
     corr = D.inv() * vcv * D.inv()
     return corr, D
 
+def vcv2corr_array(vcv):
+    """
+    numeric vcv -> corr on numpy arrays, no matrix inverse:
+    corr_ij = vcv_ij / (std_i * std_j)
+    vcv can be a stack of matrices (..., n, n), e.g. a (T x n x n) history
+    returns corr and the standard deviations (..., n)
+    """
+    vcv = np.asarray(vcv, dtype = float)
+    if vcv.shape[-1] != vcv.shape[-2]:
+        raise ValueError('variance mattrix has to be square matrix')
+    std = np.sqrt(np.diagonal(vcv, axis1 = -2, axis2 = -1))
+    corr = vcv / (std[..., :, np.newaxis] * std[..., np.newaxis, :])
+    return corr, std
+
+def corr2vcv_array(corr, std):
+    """
+    numeric corr -> vcv: vcv_ij = corr_ij * std_i * std_j, stacks broadcast
+    """
+    std = np.asarray(std, dtype = float)
+    return np.asarray(corr, dtype = float) * (std[..., :, np.newaxis] * std[..., np.newaxis, :])
+
+def eigen_clip(A, floor = 0., corr = False):
+    """
+    clip eigen values of symmetric matrices (..., n, n) at floor
+    with floor = 0 this is the nearest positive semidefinite matrix in Frobenius norm
+    corr = True rescales the result back to unit diagonal
+    """
+    w, Q = np.linalg.eigh(A)
+    B = np.matmul(Q * np.maximum(w, floor)[..., np.newaxis, :], np.swapaxes(Q, -1, -2))
+    if corr:
+        B = vcv2corr_array(B)[0]
+    return B
+
+def nearest_corr(A, tol = 1e-8, maxiter = 100, floor = 1e-12):
+    """
+    nearest correlation matrix in Frobenius norm (Higham 2002):
+    alternating projections onto the positive semidefinite cone and onto
+    unit-diagonal matrices, with Dykstra's correction
+    A can be a stack of matrices (..., n, n), iterates until all converge
+    the last unit-diagonal iterate is clipped at eigen value floor and rescaled,
+    so the result is both unit-diagonal and positive (semi)definite
+    """
+    Y = np.array(A, dtype = float)
+    dS = np.zeros(Y.shape)
+    idx = np.arange(Y.shape[-1])
+    for k in range(maxiter):
+        R = Y - dS
+        X = eigen_clip(R)
+        dS = X - R
+        Y = X.copy()
+        Y[..., idx, idx] = 1.
+        diff = np.linalg.norm(Y - X, axis = (-2, -1)) / np.linalg.norm(Y, axis = (-2, -1))
+        if np.all(diff < tol):
+            break
+    return eigen_clip(Y, floor = floor, corr = True)
+
+def check_psd(A, tol = 1e-10, eig = False):
+    """
+    numeric positive semidefinite check of a matrix or a stack (..., n, n)
+
+    a Choleski pass vectorized across the stack settles every positive definite
+    matrix; only the rest falls back to an eigen decomposition, where
+    min eigen value >= -tol still counts as semidefinite
+
+    returns
+    -------
+    psd: bool per matrix
+    min_eig: minimum eigen value per matrix, nan where Choleski passed unless eig
+    block: size of the smallest leading principal block that is not
+        positive definite, 0 where Choleski passed
+    """
+    A = np.asarray(A, dtype = float)
+    shape = A.shape[:-2]
+    n = A.shape[-1]
+    A = A.reshape((-1, n, n))
+    L = np.zeros(A.shape)
+    block = np.zeros(len(A), dtype = int)
+    for j in range(n):
+        d = A[:, j, j] - np.einsum('ij,ij->i', L[:, j, :j], L[:, j, :j])
+        bad = (d <= 0) & (block == 0)
+        block[bad] = j + 1
+        d = np.where(block > 0, 1., d)
+        L[:, j, j] = np.sqrt(d)
+        L[:, j+1:, j] = (A[:, j+1:, j] - np.einsum('ijk,ik->ij', L[:, j+1:, :j], L[:, j, :j])) / L[:, j, j][:, np.newaxis]
+    min_eig = np.full(len(A), np.nan)
+    rest = np.arange(len(A)) if eig else np.flatnonzero(block)
+    if len(rest):
+        min_eig[rest] = np.linalg.eigvalsh(A[rest])[:, 0]
+    with np.errstate(invalid = 'ignore'):
+        psd = (block == 0) | (min_eig >= -tol)
+    return psd.reshape(shape)[()], min_eig.reshape(shape)[()], block.reshape(shape)[()]
+
+def rho_bound(C, E):
+    """
+    feasible range of rho for C + rho*E to be positive semidefinite,
+    C positive definite and E symmetric; matrices can be stacked
+    with W = L^(-1) * E * L'^(-1), C = L*L': rho in [-1/max eig(W), -1/min eig(W)]
+    e.g. equicorrelation: C = I, E = ones - I (see corr_bound_equi)
+    """
+    L = np.linalg.cholesky(C)
+    X = np.linalg.solve(L, E)
+    w = np.linalg.eigvalsh(np.linalg.solve(L, np.swapaxes(X, -1, -2)))
+    with np.errstate(divide = 'ignore'):
+        lo = np.where(w[..., -1] > 0, -1. / w[..., -1], -np.inf)
+        hi = np.where(w[..., 0] < 0, -1. / w[..., 0], np.inf)
+    return lo, hi
+
+def corr_bound_equi(n):
+    """
+    feasible rho of the n x n equicorrelation matrix in demo_corr_bound:
+    eigen values 1 + (n-1)*rho and 1 - rho (n-1 times) => rho in [-1/(n-1), 1]
+    """
+    return -1. / (n - 1), 1.
+
 def demo_corr_positive_semidefinite(n):
     print 'First prove that any variance-covariance matrix is positive semidefinite:\n' 
     Sigma = demo_vcv_positive_semidefinite(n)
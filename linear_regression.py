@@ -201,22 +201,455 @@ Generalizations of Linear Model:
             lasso
 """
 
+import os
+import json
+import sqlite3
 import numpy as np
 import pandas as pd
 import scipy
-import statsmodels.formula.api as sa
+import statsmodels.api as sm
 from sklearn.linear_model import LinearRegression
-import matplotlib.pyplot as plt
-import EqPython.datamaster.eq_datamanager as eq
+from linear_system import LUdecomp_Choleski, solve_Choleski, update_Choleski, downdate_Choleski
+from hypothesis_testing import pscore
 
-EQ = eq.EQ('mysql_db_test.conf')
-aapl = EQ.download_ticker_df('AAPL','1998-1-1')
-amzn = EQ.download_ticker_df('AMZN','1998-1-1')
-aapl_adj = aapl['Adj Close']
-amzn_adj = amzn['Adj Close']
+class DataSource(object):
+    """
+    price history provider: download_ticker_df(ticker, start, end = None)
+    returns a DataFrame indexed by date, end inclusive (None: up to today)
+    """
+    def download_ticker_df(self, ticker, start, end = None):
+        raise NotImplementedError
 
-plt.scatter(aapl_adj, amzn_adj)
-plt.show()
+class EqDataSource(DataSource):
+    """
+    MySQL backed EqPython data manager, connected on first download
+    """
+    def __init__(self, conf = 'mysql_db_test.conf'):
+        self.conf = conf
+        self.eq = None
 
-result = sa.OLS(amzn_adj, aapl_adj).fit()
-print result.summary()
+    def download_ticker_df(self, ticker, start, end = None):
+        if self.eq is None:
+            import EqPython.datamaster.eq_datamanager as eq
+            self.eq = eq.EQ(self.conf)
+        df = self.eq.download_ticker_df(ticker, str(pd.Timestamp(start).date()))
+        return df.loc[:end] if end is not None else df
+
+class SQLiteDataSource(DataSource):
+    """
+    file backed stand-in for EqDataSource, e.g. for tests and offline batch jobs
+    one table with a ticker column, an ISO date column and the price columns
+    """
+    def __init__(self, path, table = 'prices'):
+        self.path = path
+        self.table = table
+
+    def store(self, ticker, df):
+        df = df.copy()
+        df.index = df.index.strftime('%Y-%m-%d')
+        df.index.name = 'date'
+        df.insert(0, 'ticker', ticker)
+        con = sqlite3.connect(self.path)
+        try:
+            df.to_sql(self.table, con, if_exists = 'append')
+        finally:
+            con.close()
+
+    def download_ticker_df(self, ticker, start, end = None):
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.today()
+        con = sqlite3.connect(self.path)
+        try:
+            df = pd.read_sql_query('SELECT * FROM "%s" WHERE ticker = ? AND date BETWEEN ? AND ? ORDER BY date' % self.table,
+                    con, params = (ticker, str(pd.Timestamp(start).date()), str(end.date())), index_col = 'date')
+        finally:
+            con.close()
+        df.index = pd.to_datetime(df.index)
+        return df.drop('ticker', axis = 1)
+
+class CachedDataSource(DataSource):
+    """
+    local columnar cache in front of another DataSource
+
+    every ticker is kept as one memory-mapped .npy file per column plus the
+    dates, with the date range already fetched recorded in meta.json;
+    a request only downloads the dates before or after that range
+    the range ends at the last date the source returned, so bars not yet
+    published when requested are fetched again next time
+    """
+    def __init__(self, source, cache_dir = '.price_cache'):
+        self.source = source
+        self.cache_dir = cache_dir
+
+    def download_ticker_df(self, ticker, start, end = None):
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.today().normalize()
+        path = os.path.join(self.cache_dir, ticker)
+        meta = self._read_meta(path)
+        if meta is None:
+            df = self.source.download_ticker_df(ticker, start, end)
+            lo, hi = start, end
+        else:
+            df = self._read(path, meta)
+            lo, hi = pd.Timestamp(meta['start']), pd.Timestamp(meta['end'])
+            parts = [df]
+            if start < lo:
+                parts.append(self.source.download_ticker_df(ticker, start, lo - pd.Timedelta(days = 1)))
+            if end > hi:
+                parts.append(self.source.download_ticker_df(ticker, hi + pd.Timedelta(days = 1), end))
+            if len(parts) > 1:
+                df = pd.concat(parts)
+                df = df[~df.index.duplicated(keep = 'last')].sort_index()
+            lo, hi = min(lo, start), max(hi, end)
+        hi = min(hi, df.index.max() if len(df) else lo - pd.Timedelta(days = 1))
+        if meta is None or (lo, hi) != (pd.Timestamp(meta['start']), pd.Timestamp(meta['end'])):
+            self._write(path, df, lo, hi)
+        return df.loc[start:end]
+
+    def _read_meta(self, path):
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                return json.load(f)
+        except IOError:
+            return None
+
+    def _read(self, path, meta):
+        dates = np.load(os.path.join(path, 'dates.npy'), mmap_mode = 'r')
+        cols = [np.load(os.path.join(path, 'c%d.npy' % i), mmap_mode = 'r') for i in range(len(meta['columns']))]
+        return pd.DataFrame(dict(zip(meta['columns'], cols)), index = pd.DatetimeIndex(np.asarray(dates)), columns = meta['columns'])
+
+    def _write(self, path, df, lo, hi):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'dates.npy'), pd.to_datetime(df.index).values.astype('datetime64[ns]'))
+        for i, col in enumerate(df.columns):
+            np.save(os.path.join(path, 'c%d.npy' % i), np.asarray(df[col], dtype = np.float64))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'columns': list(df.columns), 'start': str(lo.date()), 'end': str(hi.date())}, f)
+
+class OLSAccumulator(object):
+    """
+    ordinary least squares from sufficient statistics X'X, X'y, y'y, sum(y), n
+
+    one streaming pass over row chunks accumulates the statistics;
+    accumulators of different partitions merge by addition, so the design
+    matrix is never held in memory; y can be (n x m) to fit m responses on
+    the same regressors at once
+    intercept = True prepends a column of ones to every chunk
+    """
+    def __init__(self, intercept = True):
+        self.intercept = intercept
+        self.n = 0
+        self.xtx = self.xty = self.yty = self.ysum = 0.
+
+    def update(self, X, y):
+        X = np.asarray(X, dtype = float)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        if self.intercept:
+            X = np.column_stack((np.ones(len(X)), X))
+        y = np.asarray(y, dtype = float)
+        self.n += len(X)
+        self.xtx = self.xtx + np.dot(X.T, X)
+        self.xty = self.xty + np.dot(X.T, y)
+        self.yty = self.yty + np.einsum('i...,i...->...', y, y)
+        self.ysum = self.ysum + y.sum(axis = 0)
+        return self
+
+    def merge(self, other):
+        self.n += other.n
+        self.xtx = self.xtx + other.xtx
+        self.xty = self.xty + other.xty
+        self.yty = self.yty + other.yty
+        self.ysum = self.ysum + other.ysum
+        return self
+
+    def fit(self):
+        L = LUdecomp_Choleski(np.array(self.xtx))
+        beta = solve_Choleski(L, self.xty)
+        xtx_inv = solve_Choleski(L, np.identity(len(L)))
+        return OLSFit(self, beta, xtx_inv)
+
+class OLSFit(object):
+    """
+    coefficients, standard errors and ANOVA derived from sufficient statistics
+    (see the Accuracy Assessing notes above), attribute names follow statsmodels
+    """
+    def __init__(self, stats, beta, xtx_inv):
+        n = stats.n
+        p = len(beta)
+        k = p - 1 if stats.intercept else p
+        self.nobs = n
+        self.params = beta
+        self.xtx_inv = xtx_inv
+        self.df_model = k
+        self.df_resid = n - p
+        self.ssr = stats.yty - np.einsum('i...,i...->...', beta, stats.xty)
+        self.centered_tss = stats.yty - stats.ysum**2 / float(n) if stats.intercept else stats.yty
+        self.ess = self.centered_tss - self.ssr
+        self.mse_resid = self.ssr / self.df_resid
+        self.see = np.sqrt(self.mse_resid)
+        self.rsquared = self.ess / self.centered_tss
+        self.rsquared_adj = 1 - (1 - self.rsquared) * (n - 1. if stats.intercept else n) / self.df_resid
+        self.fvalue = (self.ess / k) / self.mse_resid
+        self.f_pvalue = pscore(x = self.fvalue, tail = 1, df = k, df2 = self.df_resid, test = 'f')
+        diag = np.diag(xtx_inv)
+        self.bse = np.sqrt(np.multiply.outer(diag, self.mse_resid))
+        self.tvalues = beta / self.bse
+        self.pvalues = pscore(x = self.tvalues, tail = 2, df = self.df_resid)
+
+    def anova(self):
+        """
+        ANOVA table of a single response
+        """
+        return pd.DataFrame({'df': [self.df_model, self.df_resid, self.df_model + self.df_resid],
+                             'SS': [self.ess, self.ssr, self.centered_tss],
+                             'MSS': [self.ess / self.df_model, self.mse_resid, np.nan],
+                             'F': [self.fvalue, np.nan, np.nan],
+                             'p': [self.f_pvalue, np.nan, np.nan]},
+                            index = ['regression', 'error', 'total'], columns = ['df', 'SS', 'MSS', 'F', 'p'])
+
+    def summary(self):
+        """
+        coefficient table of a single response
+        """
+        return pd.DataFrame({'coef': self.params, 'std err': self.bse, 't': self.tvalues, 'P>|t|': self.pvalues},
+                            columns = ['coef', 'std err', 't', 'P>|t|'])
+
+class BatchOLS(object):
+    """
+    cross-sectional batch: regress every column of Y (T x N) on the same X (T x k)
+
+    X'X is Choleski factored once and all response columns are solved
+    together (see OLSAccumulator); with ragged histories (nan in Y) the
+    columns are grouped by their missing-data pattern and each group
+    shares one factorization over its own rows; rows with nan in X are dropped
+    params, bse, tvalues, pvalues are (p x N), the rest one value per column;
+    columns with no more observations than regressors, or whose rows leave
+    X'X singular (see _check_factor), are left nan
+    """
+    def __init__(self, X, Y, intercept = True):
+        X = np.asarray(X, dtype = float)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        Y = np.asarray(Y, dtype = float)
+        if Y.ndim == 1:
+            Y = Y[:, np.newaxis]
+        N = Y.shape[1]
+        p = X.shape[1] + int(intercept)
+        mask = ~np.isnan(Y) & ~np.isnan(X).any(axis = 1)[:, np.newaxis]
+        patterns, group = np.unique(np.packbits(mask, axis = 0).T, axis = 0, return_inverse = True)
+        group = np.ravel(group)
+        attrs = ['params', 'bse', 'tvalues', 'pvalues']
+        stats = ['rsquared', 'rsquared_adj', 'fvalue', 'f_pvalue', 'ssr', 'mse_resid']
+        for a in attrs:
+            setattr(self, a, np.full((p, N), np.nan))
+        for a in stats:
+            setattr(self, a, np.full(N, np.nan))
+        self.nobs = mask.sum(axis = 0)
+        self.df_resid = self.nobs - p
+        for g in range(len(patterns)):
+            cols = np.flatnonzero(group == g)
+            rows = mask[:, cols[0]]
+            if rows.sum() <= p:
+                continue
+            acc = OLSAccumulator(intercept = intercept).update(X[rows], Y[rows][:, cols])
+            if _check_factor(None, acc.xtx) is None:
+                continue
+            fit = acc.fit()
+            for a in attrs:
+                getattr(self, a)[:, cols] = getattr(fit, a)
+            for a in stats:
+                getattr(self, a)[cols] = getattr(fit, a)
+
+class RollingOLS(object):
+    """
+    rolling (window) or expanding (window = None) OLS, addressing the
+    parameter instability limitation above
+
+    each step adds the newest observation to, and drops the oldest from,
+    the sufficient statistics X'X, X'y, y'y and sum(y) with rank-one
+    updates, so a step costs O(k^2) plus a k x k solve instead of a refit
+    over the window; all tickers are stepped together:
+    Y is (T,) or (T x N), X is (T x k) shared by every ticker (e.g. factors)
+    or (T x N x k) with regressors of their own
+    with shared X the Choleski factor of X'X is updated and downdated in
+    place (see update_Choleski) and serves every ticker whose window has no gap
+
+    rows with nan in Y or X are skipped for that ticker on both the add and
+    the drop step; nobs (T x N) counts the valid rows in each window
+    params, bse and tvalues are (T x N x p), rsquared (T x N), nan while
+    nobs < min_nobs (default p + 1, and for rolling windows before the first
+    full window) or where the window X'X is singular (N axis dropped for 1-D Y)
+    """
+    def __init__(self, X, Y, window = None, intercept = True, min_nobs = None):
+        self.window = window
+        self.intercept = intercept
+        X = np.asarray(X, dtype = float)
+        Y = np.asarray(Y, dtype = float)
+        squeeze = Y.ndim == 1
+        T = len(Y)
+        Y = Y.reshape((T, -1))
+        N = Y.shape[1]
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        if intercept:
+            X = np.concatenate((np.ones(X.shape[:-1] + (1,)), X), axis = -1)
+        shared = X.ndim == 2
+        p = X.shape[-1]
+        first = window - 1 if window and min_nobs is None else 0
+        if min_nobs is None:
+            min_nobs = p + 1
+        xrow = ~np.isnan(X).any(axis = -1)
+        valid = ~np.isnan(Y) & (xrow[:, np.newaxis] if shared else xrow)
+        Y = np.where(valid, Y, 0.)
+        if not shared:
+            X = np.where(valid[..., np.newaxis], X, 0.)
+        xtx = np.zeros((p, p) if shared else (N, p, p))
+        gap = np.zeros((N, p, p))
+        ngap = np.zeros(N, dtype = int)
+        L = None
+        xty = np.zeros((N, p))
+        yty = np.zeros(N)
+        ysum = np.zeros(N)
+        n = np.zeros(N, dtype = int)
+        self.params = np.full((T, N, p), np.nan)
+        self.bse = np.full((T, N, p), np.nan)
+        self.rsquared = np.full((T, N), np.nan)
+        self.nobs = np.zeros((T, N), dtype = int)
+        for t in range(T):
+            steps = [(t, 1)]
+            if window and t >= window:
+                steps.append((t - window, -1))
+            for s, sign in steps:
+                if shared:
+                    if not xrow[s]:
+                        continue
+                    x = X[s]
+                    xxt = np.outer(x, x)
+                    xtx += sign * xxt
+                    miss = ~valid[s]
+                    if miss.any():
+                        gap[miss] += sign * xxt
+                        ngap[miss] += sign
+                    L = _roll_factor(L, x, sign)
+                    xty += sign * np.outer(Y[s], x)
+                else:
+                    xtx += sign * np.einsum('np,nq->npq', X[s], X[s])
+                    xty += sign * X[s] * Y[s][:, np.newaxis]
+                yty += sign * Y[s] * Y[s]
+                ysum += sign * Y[s]
+                n += sign * valid[s]
+            self.nobs[t] = n
+            ready = n >= min_nobs
+            if t < first or not ready.any():
+                continue
+            beta = np.full((N, p), np.nan)
+            diag = np.full((N, p), np.nan)
+            if shared:
+                L = _check_factor(L, xtx)
+                full = ready & (ngap == 0)
+                if L is not None and full.any():
+                    xtx_inv = solve_Choleski(L, np.identity(p))
+                    beta[full] = np.dot(xty[full], xtx_inv)
+                    diag[full] = np.diag(xtx_inv)
+                part = ready & (ngap > 0)
+                if part.any():
+                    beta[part], diag[part] = _solve_spd(xtx - gap[part], xty[part])
+            else:
+                beta[ready], diag[ready] = _solve_spd(xtx[ready], xty[ready])
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                sse = yty - np.sum(beta * xty, axis = -1)
+                sst = yty - ysum**2 / n if intercept else yty
+                self.params[t] = beta
+                self.bse[t] = np.sqrt(diag * (sse / (n - p))[:, np.newaxis])
+                self.rsquared[t] = np.where(ready, 1 - sse / sst, np.nan)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            self.tvalues = self.params / self.bse
+        if squeeze:
+            self.params, self.bse, self.tvalues = self.params[:, 0], self.bse[:, 0], self.tvalues[:, 0]
+            self.rsquared, self.nobs = self.rsquared[:, 0], self.nobs[:, 0]
+
+def _roll_factor(L, x, sign):
+    """
+    rank-one update (sign 1) or downdate (sign -1) of a shared Choleski factor,
+    None once the factor is lost (refactored from X'X by _check_factor)
+    """
+    if L is None:
+        return None
+    try:
+        return update_Choleski(L, x) if sign > 0 else downdate_Choleski(L, x)
+    except ValueError:
+        return None
+
+def _check_factor(L, xtx):
+    """
+    the Choleski factor of xtx, refactored if lost, None if xtx is singular:
+    a pivot^2 below eps * p * max diag(xtx)
+    """
+    if L is None:
+        try:
+            L = LUdecomp_Choleski(np.array(xtx))
+        except ValueError:
+            return None
+    if np.diag(L).min()**2 <= np.finfo(float).eps * len(L) * np.diag(xtx).max():
+        return None
+    return L
+
+def _solve_spd(A, b):
+    """
+    solve the batch of positive definite systems A (N x p x p) x = b (N x p),
+    returns x and the diagonal of A^-1, nan for singular systems (see _check_factor)
+    """
+    N, p = b.shape
+    x = np.full((N, p), np.nan)
+    diag = np.full((N, p), np.nan)
+    try:
+        L = np.linalg.cholesky(A)
+        ok = np.ones(N, dtype = bool)
+    except np.linalg.LinAlgError:
+        L = np.zeros_like(A)
+        ok = np.zeros(N, dtype = bool)
+        for i in range(N):
+            try:
+                L[i] = np.linalg.cholesky(A[i])
+                ok[i] = True
+            except np.linalg.LinAlgError:
+                pass
+    piv = np.diagonal(L, axis1 = 1, axis2 = 2)
+    ok &= piv.min(axis = 1)**2 > np.finfo(float).eps * p * np.diagonal(A, axis1 = 1, axis2 = 2).max(axis = 1)
+    if ok.any():
+        Linv = np.linalg.inv(L[ok])
+        A_inv = np.matmul(np.swapaxes(Linv, 1, 2), Linv)
+        x[ok] = np.einsum('npq,nq->np', A_inv, b[ok])
+        diag[ok] = np.diagonal(A_inv, axis1 = 1, axis2 = 2)
+    return x, diag
+
+_SOURCE = None
+
+def default_source():
+    """
+    cached EqDataSource, created on first use instead of at import
+    """
+    global _SOURCE
+    if _SOURCE is None:
+        _SOURCE = CachedDataSource(EqDataSource('mysql_db_test.conf'))
+    return _SOURCE
+
+def load_adj_close(tickers, start = '1998-1-1', end = None, source = None):
+    """
+    adjusted close of each ticker as one column, on dates shared by all
+    """
+    source = source or default_source()
+    return pd.DataFrame(dict((t, source.download_ticker_df(t, start, end)['Adj Close']) for t in tickers)).dropna()
+
+def regress_adj_close(y, x, start = '1998-1-1', end = None, source = None, plot = False):
+    px = load_adj_close([y, x], start = start, end = end, source = source)
+    if plot:
+        import matplotlib.pyplot as plt
+        plt.scatter(px[x], px[y])
+        plt.show()
+    return sm.OLS(px[y], px[x]).fit()
+
+if __name__ == '__main__':
+    result = regress_adj_close('AMZN', 'AAPL', plot = True)
+    print result.summary()
@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 
 #augmented coefficient matrix: adjoin the constant vector b to the coefficient matrix A
@@ -29,18 +30,37 @@ def solve_elimin_Gauss(A, b):
         b[i] = (b[i] - np.dot(A[i, i+1:n], b[i+1: n]))/A[i, i]
     return b
 
-def solve_LUdecomp_Doolittle(A, b):
+def solve_LUdecomp_Doolittle(A, b, cache = False):
     """
     solving linear system using Doolittle's Method LU Decomposition
+    b can be a vector or a (n x k) matrix B, all columns are substituted together
+
+    with cache = True A is left untouched and its decomposition is kept,
+    keyed by a hash of the matrix, so solving the same system again
+    (e.g. one covariance matrix against batches of scenarios) skips refactoring
     """
-    n = len(b)
-    LUdecomp_Doolittle(A)
-    for i in range(1, n):
-        b[i] = b[i] - np.dot(A[i, 0:i], b[0: i])
-    for i in range(n-1, -1, -1):
-        b[i] = (b[i] - np.dot(A[i, i+1:n], b[i+1: n]))/A[i, i]
+    if cache:
+        A = _LUdecomp_cached(A)
+    else:
+        LUdecomp_Doolittle(A)
+    _subst_lower(A, b, 64, unit = True)
+    _subst_upper(A, b, 64)
     return b
 
+_LU_CACHE = {}
+_LU_CACHE_SIZE = 8
+
+def _LUdecomp_cached(A):
+    A = np.ascontiguousarray(A)
+    key = (A.shape, A.dtype.str, hashlib.sha1(A.tobytes()).hexdigest())
+    LU = _LU_CACHE.get(key)
+    if LU is None:
+        if len(_LU_CACHE) >= _LU_CACHE_SIZE:
+            _LU_CACHE.pop(next(iter(_LU_CACHE)))
+        LU = LUdecomp_Doolittle(A.copy())
+        _LU_CACHE[key] = LU
+    return LU
+
 def LUdecomp_Doolittle(A):
     """LU decomposition using Doolittle's Method
        L = array([[1,   0,   0],
@@ -62,22 +82,589 @@ def LUdecomp_Doolittle(A):
                 A[j, i] = lam
     return A
 
-def LUdecomp_Choleski(A):
+class LUFactor(object):
+    """
+    LU decomposition with partial (row) pivoting, P*A = L*U
+    factored once and reused for any number of right hand sides
+
+    right-looking blocked algorithm: each panel of `block` columns is
+    factored with row pivoting, then the trailing matrix gets a single
+    rank-`block` update np.dot(L21, U12) instead of one update per column
+    L (unit diagonal) and U are stored in place in self.lu as in LUdecomp_Doolittle
+    raise ValueError if a pivot is below tol * max|A| (singular or near-singular)
+    dtype = np.float32 factors in single precision (see solve_mixed)
+    """
+    def __init__(self, A, block = 64, tol = None, overwrite = False, dtype = float):
+        A = np.array(A, dtype = dtype, copy = not overwrite)
+        n, m = A.shape
+        if n != m:
+            raise ValueError('coefficient matrix has to be square matrix')
+        if tol is None:
+            tol = np.finfo(A.dtype).eps
+        thres = tol * np.abs(A).max()
+        perm = np.arange(n)
+        nswap = 0
+        for k0 in range(0, n, block):
+            k1 = min(k0 + block, n)
+            for j in range(k0, k1):
+                p = j + np.argmax(np.abs(A[j:, j]))
+                if np.abs(A[p, j]) <= thres:
+                    raise ValueError('matrix is singular or near-singular: pivot %g in column %d' % (A[p, j], j))
+                if p != j:
+                    A[[j, p]] = A[[p, j]]
+                    perm[[j, p]] = perm[[p, j]]
+                    nswap += 1
+                A[j+1:, j] /= A[j, j]
+                A[j+1:, j+1:k1] -= np.outer(A[j+1:, j], A[j, j+1:k1])
+            for j in range(k0, k1):
+                A[j+1:k1, k1:] -= np.outer(A[j+1:k1, j], A[j, k1:])
+            A[k1:, k1:] -= np.dot(A[k1:, k0:k1], A[k0:k1, k1:])
+        self.lu = A
+        self.perm = perm
+        self.nswap = nswap
+        self.block = block
+        self.n = n
+
+    @property
+    def L(self):
+        return np.tril(self.lu, -1) + np.identity(self.n)
+
+    @property
+    def U(self):
+        return np.triu(self.lu)
+
+    def det(self):
+        return (-1)**self.nswap * np.prod(np.diag(self.lu))
+
+    def solve(self, b, trans = False):
+        """
+        solve A x = b (or A' x = b if trans),
+        b is a vector or a (n x k) matrix of right hand sides
+        """
+        if trans:
+            b = np.array(b, dtype = self.lu.dtype)
+            _subst_lower(self.lu.T, b, self.block)
+            _subst_upper(self.lu.T, b, self.block, unit = True)
+            x = np.empty_like(b)
+            x[self.perm] = b
+            return x
+        b = np.asarray(b, dtype = self.lu.dtype)[self.perm]
+        _subst_lower(self.lu, b, self.block, unit = True)
+        _subst_upper(self.lu, b, self.block)
+        return b
+
+def _subst_lower(L, b, block, unit = False):
+    """
+    blocked forward substitution in place, uses the lower triangle of L
+    """
+    n = len(L)
+    for k0 in range(0, n, block):
+        k1 = min(k0 + block, n)
+        for i in range(k0, k1):
+            b[i] -= np.dot(L[i, k0:i], b[k0:i])
+            if not unit:
+                b[i] /= L[i, i]
+        b[k1:] -= np.dot(L[k1:, k0:k1], b[k0:k1])
+    return b
+
+def _subst_upper(U, b, block, unit = False):
+    """
+    blocked back substitution in place, uses the upper triangle of U
+    """
+    n = len(U)
+    for k1 in range(n, 0, -block):
+        k0 = max(k1 - block, 0)
+        for i in range(k1-1, k0-1, -1):
+            b[i] -= np.dot(U[i, i+1:k1], b[i+1:k1])
+            if not unit:
+                b[i] /= U[i, i]
+        b[:k0] -= np.dot(U[:k0, k0:k1], b[k0:k1])
+    return b
+
+def full2band(A, l, u):
+    """
+    compact band storage of a matrix with l sub- and u super-diagonals
+    ab[u + i - j, j] = A[i, j], ab has shape (l + u + 1, n)
+    """
+    n = len(A)
+    ab = np.zeros((l + u + 1, n))
+    for d in range(-l, u + 1):
+        ab[u - d, max(d, 0):n + min(d, 0)] = np.diagonal(A, d)
+    return ab
+
+def LUdecomp_band(ab, l, u):
+    """
+    Doolittle's LU decomposition in compact band storage (see full2band)
+    O(n*l*u) time, the factors overwrite ab in the same layout
+    no pivoting: intended for diagonally dominant or positive definite banded matrices
+    tridiagonal systems are cheaper through solve_tridiag
+    """
+    n = ab.shape[1]
+    i = np.arange(1, l+1)[:, np.newaxis]
+    j = np.arange(1, u+1)[np.newaxis, :]
+    for k in range(n-1):
+        m = min(l, n-1-k)
+        q = min(u, n-1-k)
+        if m == 0:
+            continue
+        ab[u+1:u+1+m, k] /= ab[u, k]
+        im, jq = i[:m], j[:, :q]
+        ab[u+im-jq, k+jq] -= ab[u+im, k] * ab[u-jq, k+jq]
+    return ab
+
+def solve_LUdecomp_band(ab, l, u, b):
+    """
+    solving banded linear system with LU decomposition in compact band storage
+    b can be a vector or a (n x k) matrix; ab and b are overwritten
+    """
+    n = ab.shape[1]
+    LUdecomp_band(ab, l, u)
+    for k in range(n-1):
+        m = min(l, n-1-k)
+        b[k+1:k+1+m] -= np.multiply.outer(ab[u+1:u+1+m, k], b[k])
+    j = np.arange(1, u+1)
+    for k in range(n-1, -1, -1):
+        jq = j[:min(u, n-1-k)]
+        b[k] = (b[k] - np.dot(ab[u-jq, k+jq], b[k+jq]))/ab[u, k]
+    return b
+
+def solve_tridiag(a, d, c, b):
+    """
+    Thomas algorithm for tridiagonal systems, O(n)
+    a: sub-diagonal (a[..., 0] unused), d: diagonal, c: super-diagonal (c[..., -1] unused)
+    all arrays can carry leading batch axes (m x n), solving m independent systems at once
+    no pivoting: assume diagonally dominant systems (splines, implicit finite differences)
+    empty systems (n = 0) return an empty solution
+    """
+    a, d, c, b = np.broadcast_arrays(*[np.asarray(v, dtype = float) for v in (a, d, c, b)])
+    if not d.shape[-1]:
+        return np.zeros(d.shape)
+    if d.ndim == 1:
+        return _solve_tridiag_1d(a.tolist(), d.tolist(), c.tolist(), b.tolist())
+    n = d.shape[-1]
+    cp = np.empty(d.shape)
+    x = np.empty(d.shape)
+    cp[..., 0] = c[..., 0]/d[..., 0]
+    x[..., 0] = b[..., 0]/d[..., 0]
+    for i in range(1, n):
+        denom = d[..., i] - a[..., i]*cp[..., i-1]
+        cp[..., i] = c[..., i]/denom
+        x[..., i] = (b[..., i] - a[..., i]*x[..., i-1])/denom
+    for i in range(n-2, -1, -1):
+        x[..., i] -= cp[..., i]*x[..., i+1]
+    return x
+
+def _solve_tridiag_1d(a, d, c, b):
+    """
+    single system Thomas sweep on python floats,
+    much cheaper per step than numpy scalar indexing
+    """
+    n = len(d)
+    cp = [0.] * n
+    x = [0.] * n
+    cp[0] = c[0]/d[0]
+    x[0] = b[0]/d[0]
+    for i in range(1, n):
+        denom = d[i] - a[i]*cp[i-1]
+        cp[i] = c[i]/denom
+        x[i] = (b[i] - a[i]*x[i-1])/denom
+    for i in range(n-2, -1, -1):
+        x[i] -= cp[i]*x[i+1]
+    return np.array(x)
+
+def cond1_estimate(A, factor = None):
+    """
+    estimate of the 1-norm condition number cond(A) = ||A||_1 * ||A^(-1)||_1
+    ||A^(-1)||_1 is estimated with Hager's method (Higham's refinement) from a
+    handful of solves against an existing factor, never forming the inverse
+    factor: LUFactor of A, or the lower triangular Choleski factor L of A,
+    A is factored with LUFactor if not given
+    """
+    if factor is None:
+        factor = LUFactor(A)
+    if isinstance(factor, LUFactor):
+        solve = lambda v: factor.solve(v)
+        solveT = lambda v: factor.solve(v, trans = True)
+    else:
+        L = factor
+        solve = solveT = lambda v: solve_Choleski(L, v)
+    return np.abs(A).sum(axis = 0).max() * _norm1_inv(solve, solveT, len(A))
+
+def _norm1_inv(solve, solveT, n, maxiter = 5):
+    """
+    Hager / Higham estimate of ||A^(-1)||_1 from solves with A and A'
+    """
+    x = np.ones(n)/n
+    est = 0.0
+    j = -1
+    for k in range(maxiter):
+        y = solve(x)
+        est = np.abs(y).sum()
+        z = solveT(np.where(y >= 0, 1.0, -1.0))
+        jn = np.argmax(np.abs(z))
+        if np.abs(z[jn]) <= np.dot(z, x) or jn == j:
+            break
+        j = jn
+        x = np.zeros(n)
+        x[j] = 1.0
+    alt = (-1.0)**np.arange(n) * (1 + np.arange(n)/max(n - 1., 1.))
+    return max(est, 2*np.abs(solve(alt)).sum()/(3.*n))
+
+def solve_mixed(A, b, tol = None, maxiter = 10, block = 64):
+    """
+    solve A x = b factoring A in float32 and refining x in float64:
+    x += A32^(-1) * (b - A*x), residuals in double precision
+    converges to about double precision accuracy while cond(A) is well below
+    1/eps(float32) ~ 1e7; converged = False flags an ill-conditioned A,
+    a numerically singular float32 factor raises ValueError from LUFactor
+
+    returns x, number of refinement steps, converged
+    """
+    A = np.asarray(A, dtype = float)
+    b = np.asarray(b, dtype = float)
+    if tol is None:
+        tol = len(A) * np.finfo(float).eps
+    factor = LUFactor(A, block = block, dtype = np.float32)
+    x = factor.solve(b.astype(np.float32)).astype(float)
+    anorm = np.abs(A).sum(axis = 1).max()
+    for k in range(maxiter):
+        r = b - np.dot(A, x)
+        if np.abs(r).max() <= tol * (anorm * np.abs(x).max() + np.abs(b).max()):
+            return x, k, True
+        x += factor.solve(r.astype(np.float32))
+    return x, maxiter, False
+
+def LUdecomp_Choleski(A, block = 64):
     """LU decomposition using Choleski's Method
     Assumptions of A: 1) symmetric; 2) positive definite
     A = LL' = array([[l_11^2,   l_11*l_21,            l_11*l_31],
                      [l_11*l_21,l_21^2 + l_22^2,      l_21*l_31 + l_22*l_32],
                      [l_11*l_31,l_21*l_31 + l_22*l_32,l_31^2 + l_32^2 + l_33^2]])
+
+    blocked in place: each diagonal block is factored row by row, the panel
+    below it is solved against it, and the trailing matrix gets one
+    rank-`block` update np.dot(L21, L21.T)
+    raise ValueError naming the first non-positive pivot if A is not positive definite
     """
     n = len(A)
-    for i in range(n):
-        A[i, i]= np.sqrt(A[i, i] - np.dot(A[i, 0:i], A[i, 0:i]))
-        for j in range(i+1, n):
-            A[j, i] = (A[j, i] - np.dot(A[j, 0:i], A[i, 0:i]))/A[i, i]
-        A[i, i+1:n] = 0.0
+    for k0 in range(0, n, block):
+        k1 = min(k0 + block, n)
+        for i in range(k0, k1):
+            d = A[i, i] - np.dot(A[i, k0:i], A[i, k0:i])
+            if not d > 0:
+                raise ValueError('matrix is not positive definite: pivot %d is %g' % (i, d))
+            A[i, i] = np.sqrt(d)
+            A[i+1:k1, i] = (A[i+1:k1, i] - np.dot(A[i+1:k1, k0:i], A[i, k0:i]))/A[i, i]
+        for i in range(k0, k1):
+            A[k1:, i] = (A[k1:, i] - np.dot(A[k1:, k0:i], A[i, k0:i]))/A[i, i]
+        A[k1:, k1:] -= np.dot(A[k1:, k0:k1], A[k1:, k0:k1].T)
+    A[np.triu_indices(n, 1)] = 0.0
     return A
 
+def solve_Choleski(L, b, block = 64):
+    """
+    solve A x = b given the Choleski factor L of A (A = L*L')
+    b can be a vector or a (n x k) matrix, b is not overwritten
+    """
+    b = np.array(b, dtype = float)
+    return _subst_upper(L.T, _subst_lower(L, b, block), block)
+
+def update_Choleski(L, x):
+    """
+    rank-one update in place: L becomes the Choleski factor of L*L' + x*x', O(n^2)
+    """
+    x = np.array(x, dtype = float)
+    n = len(L)
+    for k in range(n):
+        r = np.hypot(L[k, k], x[k])
+        c = r/L[k, k]
+        s = x[k]/L[k, k]
+        L[k, k] = r
+        L[k+1:, k] = (L[k+1:, k] + s*x[k+1:])/c
+        x[k+1:] = c*x[k+1:] - s*L[k+1:, k]
+    return L
+
+def downdate_Choleski(L, x):
+    """
+    rank-one downdate in place: L becomes the Choleski factor of L*L' - x*x', O(n^2)
+    raise ValueError naming the pivot where the result stops being positive definite
+    """
+    x = np.array(x, dtype = float)
+    n = len(L)
+    for k in range(n):
+        d = (L[k, k] - x[k])*(L[k, k] + x[k])
+        if not d > 0:
+            raise ValueError('downdated matrix is not positive definite: pivot %d is %g' % (k, d))
+        r = np.sqrt(d)
+        c = r/L[k, k]
+        s = x[k]/L[k, k]
+        L[k, k] = r
+        L[k+1:, k] = (L[k+1:, k] - s*x[k+1:])/c
+        x[k+1:] = c*x[k+1:] - s*L[k+1:, k]
+    return L
+
+def roll_Choleski(L, x_new, x_old):
+    """
+    slide a window of the scatter matrix X'X = L*L' by one observation:
+    add row x_new and drop row x_old in O(n^2) instead of refactoring
+    """
+    return downdate_Choleski(update_Choleski(L, x_new), x_old)
+
 """
 QR decomposition: 
 unique pair of orthogonal matrix and upper_triangular matrix w/ positive diagonal elements
 """
+
+def QRdecomp_Householder(A, block = 32):
+    """QR decomposition using Householder reflections, A = Q*R for (m x n) A
+    R overwrites the upper triangle of A, the Householder vectors v_j (v_j[0] = 1 implied)
+    the part below the diagonal, Q = H_1*H_2*...*H_k with H_j = I - tau_j*v_j*v_j', k = min(m, n)
+
+    blocked with the compact WY form: the reflectors of a panel of `block` columns
+    are aggregated as I - V*T*V' and applied to the trailing columns with
+    3 matrix products instead of one rank-one update per reflector
+    """
+    m, n = A.shape
+    kmax = min(m, n)
+    tau = np.zeros(kmax)
+    for k0 in range(0, kmax, block):
+        k1 = min(k0 + block, kmax)
+        for j in range(k0, k1):
+            x0 = A[j, j]
+            sigma = np.dot(A[j+1:, j], A[j+1:, j])
+            if sigma == 0.0:
+                continue
+            beta = -np.copysign(np.sqrt(x0*x0 + sigma), x0)
+            tau[j] = (beta - x0)/beta
+            A[j+1:, j] /= (x0 - beta)
+            A[j, j] = beta
+            v = np.concatenate(([1.0], A[j+1:, j]))
+            A[j:, j+1:k1] -= tau[j]*np.outer(v, np.dot(v, A[j:, j+1:k1]))
+        if k1 < n:
+            V = np.tril(A[k0:, k0:k1], -1)
+            V[np.arange(k1 - k0), np.arange(k1 - k0)] = 1.0
+            T = _householder_T(V, tau[k0:k1])
+            A[k0:, k1:] -= np.dot(V, np.dot(T.T, np.dot(V.T, A[k0:, k1:])))
+    return A, tau
+
+def _householder_T(V, tau):
+    """
+    upper triangular T of the compact WY form H_1*...*H_k = I - V*T*V'
+    """
+    k = len(tau)
+    T = np.zeros((k, k))
+    for i in range(k):
+        T[i, i] = tau[i]
+        T[:i, i] = -tau[i]*np.dot(T[:i, :i], np.dot(V[:, :i].T, V[:, i]))
+    return T
+
+def apply_QT(QR, tau, b):
+    """
+    overwrite b with Q'*b given the output of QRdecomp_Householder
+    b can be a vector or a (m x k) matrix
+    """
+    for j in range(len(tau)):
+        if tau[j] == 0.0:
+            continue
+        v = np.concatenate(([1.0], QR[j+1:, j]))
+        b[j:] -= tau[j]*np.multiply.outer(v, np.dot(v, b[j:]))
+    return b
+
+def solve_lstsq_QR(A, b, block = 32):
+    """
+    least squares solution of A x = b through Householder QR
+    min ||b - A x|| <=> R x = (Q'b)[:n]; A and b are overwritten
+    returns x (a view on b[:n]), b[n:] holds the residuals in the rotated basis
+    """
+    n = A.shape[1]
+    QR, tau = QRdecomp_Householder(A, block = block)
+    apply_QT(QR, tau, b)
+    _subst_upper(QR[:n, :n], b[:n], block)
+    return b[:n]
+
+class TSQR(object):
+    """
+    tall-skinny QR of an augmented design [X | y] streamed in row chunks
+
+    every chunk is factored on its own, and only the (p+1 x p+1) upper
+    triangular R of [X | y] is carried; R factors of chunks or of other
+    TSQR objects (shards) merge by factoring their stack, so a least
+    squares fit never needs the full design matrix in memory
+    R[:p, :p] is the R of X, R[:p, p] = (Q'y)[:p] and R[p, p]^2 = SSE
+    """
+    def __init__(self, block = 32):
+        self.R = None
+        self.n = 0
+        self.block = block
+
+    def update(self, X, y):
+        X = np.asarray(X, dtype = float)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        Z = np.column_stack((X, np.asarray(y, dtype = float)))
+        self.n += len(Z)
+        return self._stack(Z)
+
+    def merge(self, other):
+        if other.R is not None:
+            self.n += other.n
+            self._stack(other.R)
+        return self
+
+    def _stack(self, Z):
+        if self.R is not None:
+            Z = np.vstack((self.R, Z))
+        p = Z.shape[1]
+        QR = QRdecomp_Householder(Z, block = self.block)[0]
+        self.R = np.triu(QR[:min(len(QR), p)])
+        return self
+
+    def solve(self):
+        """
+        least squares coefficients, also sets self.sse
+        """
+        p = self.R.shape[1] - 1
+        self.sse = self.R[p, p]**2 if len(self.R) > p else 0.0
+        return _subst_upper(self.R[:p, :p], self.R[:p, p].copy(), self.block)
+
+def solve_CG(A, b, x0 = None, M = None, tol = 1e-8, maxiter = None, callback = None):
+    """
+    preconditioned conjugate gradient for symmetric positive definite systems
+    A: dense array, scipy sparse (CSR) matrix or a matrix-free function x -> A*x
+    x0: warm start, M: preconditioner r -> M^(-1)*r (see precond_Jacobi, precond_IC0)
+    callback(k, res) is called every iteration with the relative residual ||r||/||b||
+
+    returns x, number of iterations, converged
+    """
+    matvec = _matvec(A)
+    b = np.asarray(b, dtype = float)
+    if maxiter is None:
+        maxiter = len(b)
+    x = np.zeros(len(b)) if x0 is None else np.array(x0, dtype = float)
+    r = b - matvec(x)
+    bnorm = np.linalg.norm(b) or 1.0
+    res = np.linalg.norm(r)/bnorm
+    if res < tol:
+        return x, 0, True
+    z = M(r) if M else r
+    p = z.copy()
+    rz = np.dot(r, z)
+    for k in range(maxiter):
+        Ap = matvec(p)
+        alpha = rz/np.dot(p, Ap)
+        x += alpha*p
+        r -= alpha*Ap
+        res = np.linalg.norm(r)/bnorm
+        if callback:
+            callback(k, res)
+        if res < tol:
+            return x, k+1, True
+        z = M(r) if M else r
+        rz, rz_old = np.dot(r, z), rz
+        p = z + (rz/rz_old)*p
+    return x, maxiter, False
+
+def solve_GMRES(A, b, x0 = None, M = None, restart = 50, tol = 1e-8, maxiter = None, callback = None):
+    """
+    restarted GMRES(restart) with right preconditioning for general nonsingular systems
+    Arnoldi basis by classical Gram-Schmidt applied twice, least squares on
+    the Hessenberg matrix through Givens rotations
+    A, x0, M and callback as in solve_CG
+
+    returns x, number of iterations, converged
+    """
+    matvec = _matvec(A)
+    b = np.asarray(b, dtype = float)
+    n = len(b)
+    if maxiter is None:
+        maxiter = n
+    precond = M if M else (lambda v: v)
+    x = np.zeros(n) if x0 is None else np.array(x0, dtype = float)
+    bnorm = np.linalg.norm(b) or 1.0
+    it = 0
+    while True:
+        r = b - matvec(x)
+        beta = np.linalg.norm(r)
+        if beta/bnorm < tol:
+            return x, it, True
+        if it >= maxiter:
+            return x, it, False
+        m = min(restart, maxiter - it)
+        V = np.zeros((m + 1, n))
+        H = np.zeros((m + 1, m))
+        cs = np.zeros(m)
+        sn = np.zeros(m)
+        g = np.zeros(m + 1)
+        V[0] = r/beta
+        g[0] = beta
+        for j in range(m):
+            w = matvec(precond(V[j]))
+            for _ in range(2):
+                h = np.dot(V[:j+1], w)
+                w -= np.dot(h, V[:j+1])
+                H[:j+1, j] += h
+            H[j+1, j] = np.linalg.norm(w)
+            if H[j+1, j] > 0:
+                V[j+1] = w/H[j+1, j]
+            for i in range(j):
+                H[i, j], H[i+1, j] = cs[i]*H[i, j] + sn[i]*H[i+1, j], -sn[i]*H[i, j] + cs[i]*H[i+1, j]
+            d = np.hypot(H[j, j], H[j+1, j])
+            cs[j], sn[j] = H[j, j]/d, H[j+1, j]/d
+            H[j, j], H[j+1, j] = d, 0.0
+            g[j], g[j+1] = cs[j]*g[j], -sn[j]*g[j]
+            it += 1
+            res = abs(g[j+1])/bnorm
+            if callback:
+                callback(it - 1, res)
+            if res < tol:
+                break
+        y = _subst_upper(H[:j+1, :j+1], g[:j+1].copy(), 64)
+        x += precond(np.dot(y, V[:j+1]))
+
+def _matvec(A):
+    """
+    x -> A*x for dense arrays, scipy sparse matrices or matrix-free functions
+    """
+    if callable(A):
+        return A
+    return A.dot
+
+def precond_Jacobi(A):
+    """
+    diagonal (Jacobi) preconditioner r -> r / diag(A)
+    """
+    d = np.asarray(A.diagonal(), dtype = float)
+    return lambda r: r/d
+
+def precond_IC0(A):
+    """
+    zero fill-in incomplete Choleski preconditioner for a sparse SPD matrix:
+    L keeps the sparsity pattern of tril(A), M^(-1)*r = (L*L')^(-1)*r
+    raise ValueError naming the pivot if the incomplete factorization breaks down
+    """
+    import scipy.sparse as sp
+    from scipy.sparse.linalg import splu
+    L = sp.tril(sp.csr_matrix(A, dtype = float)).tocsr()
+    L.sort_indices()
+    indptr, indices, data = L.indptr, L.indices, L.data
+    n = L.shape[0]
+    for i in range(n):
+        lo, hi = indptr[i], indptr[i+1]
+        pos = dict(zip(indices[lo:hi], range(lo, hi)))
+        for t in range(lo, hi):
+            k = indices[t]
+            if k == i:
+                d = data[t] - np.dot(data[lo:t], data[lo:t])
+                if not d > 0:
+                    raise ValueError('incomplete Choleski breaks down: pivot %d is %g' % (i, d))
+                data[t] = np.sqrt(d)
+                break
+            s = data[t]
+            for u in range(indptr[k], indptr[k+1] - 1):
+                v = pos.get(indices[u])
+                if v is not None:
+                    s -= data[v]*data[u]
+            data[t] = s/data[indptr[k+1] - 1]
+    lu = splu(L.tocsc(), permc_spec = 'NATURAL', diag_pivot_thresh = 0., options = dict(SymmetricMode = True))
+    return lambda r: lu.solve(lu.solve(r), trans = 'T')
+
@@ -0,0 +1,115 @@
+"""
+Model Assessment diagnostics of linear_regression, batched across models
+
+heteroskedasticity:
+    Breusch-Pagan chi-square test: BP = n * R_resid^2 with df = k
+        R_resid^2 from regressing the squared residuals on the regressors
+    White-corrected (heteroskedasticity robust) standard errors:
+        Var(b) = (X'X)^(-1) * X' diag(e^2) X * (X'X)^(-1)
+serial correlation:
+    Durbin-Watson: DW = sum (e_t - e_(t-1))^2 / SSE
+    Newey-West (Hansen method) standard errors: White's middle term plus
+        Bartlett-weighted autocovariances of x_t * e_t up to a lag
+
+every function takes the design X (T x p, constant included) shared by all
+models and the residuals E (T x N), one column per model, so N regressions
+are assessed with a handful of matrix products
+"""
+import numpy as np
+from hypothesis_testing import pscore, decirule
+from linear_regression import OLSAccumulator
+
+def durbin_watson(resid):
+    """
+    Durbin-Watson statistic per residual column
+    """
+    resid = np.asarray(resid, dtype = float)
+    return np.sum(np.diff(resid, axis = 0)**2, axis = 0) / np.sum(resid**2, axis = 0)
+
+def breusch_pagan(X, resid, sig = None):
+    """
+    Breusch-Pagan chi-square test per residual column, df = k non-constant regressors
+    the auxiliary regression always has an intercept, whether or not X holds
+    a constant column; one auxiliary factorization serves all columns
+    """
+    X = np.asarray(X, dtype = float)
+    resid = np.asarray(resid, dtype = float)
+    Z = X[:, np.ptp(X, axis = 0) > 0]
+    aux = OLSAccumulator(intercept = True).update(Z, resid**2).fit()
+    df = Z.shape[1]
+    bp = len(X) * aux.rsquared
+    p = pscore(x = bp, tail = 1, df = df, test = 'chi2')
+    return decirule(bp, p, sig)
+
+def white_se(X, resid, xtx_inv, kind = 'HC0'):
+    """
+    White-corrected standard errors (p x N); kind 'HC1' scales by n / (n - p)
+    """
+    X = np.asarray(X, dtype = float)
+    resid = np.asarray(resid, dtype = float)
+    n, p = X.shape
+    meat = _cross_moment(X, X, resid**2)
+    if kind == 'HC1':
+        meat *= n / float(n - p)
+    return _sandwich_se(xtx_inv, meat)
+
+def newey_west_se(X, resid, xtx_inv, lags = None):
+    """
+    Newey-West (Hansen method) standard errors (p x N) with Bartlett weights,
+    lags defaults to floor(4 * (T/100)^(2/9))
+    """
+    X = np.asarray(X, dtype = float)
+    resid = np.asarray(resid, dtype = float)
+    n = len(X)
+    if lags is None:
+        lags = int(np.floor(4 * np.power(n / 100., 2 / 9.)))
+    meat = _cross_moment(X, X, resid**2)
+    for l in range(1, lags + 1):
+        gamma = _cross_moment(X[l:], X[:-l], resid[l:] * resid[:-l])
+        meat += (1 - l / (lags + 1.)) * (gamma + np.swapaxes(gamma, 1, 2))
+    return _sandwich_se(xtx_inv, meat)
+
+def _cross_moment(A, B, w):
+    """
+    sum_t w_tn * a_t * b_t' for every column n of w, as (N x p x p),
+    one matrix product over the flattened outer products
+    """
+    T, p = A.shape
+    outer = (A[:, :, np.newaxis] * B[:, np.newaxis, :]).reshape((T, p*p))
+    return np.dot(outer.T, w).T.reshape((-1, p, p))
+
+def _sandwich_se(bread, meat):
+    cov = np.matmul(np.matmul(bread, meat), bread)
+    return np.sqrt(np.diagonal(cov, axis1 = 1, axis2 = 2)).T
+
+class RegressionDiagnostics(object):
+    """
+    full Model Assessment of N regressions on the same regressors X (T x k)
+    Y is (T x N) without missing values (fit ragged histories by group, see BatchOLS)
+
+    fits once through OLSAccumulator (or takes an existing OLSFit of the same
+    data), caches the residuals and (X'X)^(-1) and derives from them:
+    dw, bp / bp_pvalue, white_se / white_pvalues, nw_se / nw_pvalues
+    """
+    def __init__(self, X, Y, intercept = True, fit = None, lags = None, kind = 'HC0'):
+        X = np.asarray(X, dtype = float)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        Y = np.asarray(Y, dtype = float)
+        if Y.ndim == 1:
+            Y = Y[:, np.newaxis]
+        if fit is None:
+            fit = OLSAccumulator(intercept = intercept).update(X, Y).fit()
+        self.fit = fit
+        if intercept:
+            X = np.column_stack((np.ones(len(X)), X))
+        params = np.reshape(fit.params, (X.shape[1], -1))
+        self.resid = Y - np.dot(X, params)
+        self.xtx_inv = fit.xtx_inv
+        self.dw = durbin_watson(self.resid)
+        self.bp, self.bp_pvalue = breusch_pagan(X, self.resid)
+        self.white_se = white_se(X, self.resid, self.xtx_inv, kind = kind)
+        self.nw_se = newey_west_se(X, self.resid, self.xtx_inv, lags = lags)
+        df = len(X) - X.shape[1]
+        self.white_pvalues = pscore(x = params / self.white_se, tail = 2, df = df)
+        self.nw_pvalues = pscore(x = params / self.nw_se, tail = 2, df = df)
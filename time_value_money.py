@@ -25,6 +25,10 @@ import numpy as np
 import pandas as pd
 from scipy.optimize import newton
 
+AMT_LABEL = ['begin_balance','payment','interest','principal','end_balance']
+
+POOL_LABEL = ['begin_balance','interest','sched_principal','prepayment','default','end_balance']
+
 class FixIncome(object):
    
     def cpt_ear(self, nom_rate, num_comp = 1, cc = False):
@@ -132,23 +136,86 @@ class Annuity(FixIncome):
         amortization schedule construction
         on top of cpt_pmt
         """
-        label = ['begin_balance','payment','interest','principal','end_balance']
-        df = pd.DataFrame(np.zeros((self.maturity, len(label))), columns = label)
-        balance = self.pv
-        n = self.maturity
-        for i in range(n):
-            df.ix[i,0] = balance
-            df.ix[i,1] = self.pmt
-            df.ix[i,2] = balance*self.r
-            df.ix[i,3] = self.pmt - df.ix[i,2]
-            balance -= df.ix[i, 3]
-            df.ix[i,4] = balance
-        err = df.ix[n-1, 4]
-        df.ix[n-1, [1,3]] += (err, err)
-        df.ix[n-1, 4] -= err
-        self.amt = df
+        sched = _amt(pv = self.pv, pmt = self.pmt, r = self.r, n = self.maturity)
+        self.amt = pd.DataFrame(sched[AMT_LABEL], columns = AMT_LABEL)
         return self.amt
 
+    def cpt_amt_batch(self, mat, pv, r, frame = False):
+        """
+        amortization schedules of a batch of level-payment loans
+        stacked into one structured array (or DataFrame if frame)
+        with a loan and period column in front of the schedule columns
+        does not write any state onto the instance
+        """
+        mat = np.asarray(mat, dtype = np.int64)
+        pv = np.asarray(pv, dtype = np.float64)
+        r = np.asarray(r, dtype = np.float64)
+        sched = _amt(pv = pv, pmt = _pmt(pv = pv, r = r, n = mat), r = r, n = mat)
+        if frame:
+            return pd.DataFrame(sched)
+        return sched
+
+class LoanPool(Annuity):
+    """
+    aggregate cash flows of a pool of level-payment loans
+    under pool-level prepayment (CPR) and default (CDR) curves
+
+    prepayments and defaults reduce every loan pro rata, so each loan stays on
+    its own amortization curve scaled by the pool survival factor
+    S_t = prod (1 - mdr) * (1 - smm); the pool only needs the sum of scheduled
+    balances per period, which is accumulated chunk by chunk
+    with cpr = cdr = 0 a pool of one loan reproduces Annuity.cpt_amt
+    """
+    def __init__(self, freq = 12):
+        self.freq = freq
+        self.type = 1
+
+    def cpt_cashflow(self, mat, pv, r, cpr = 0, cdr = 0, horizon = None, chunk = 100000):
+        """
+        Parameters
+        ----------
+        mat: remaining number of payments per loan
+        pv: outstanding balance per loan
+        r: interest rate per payment period per loan
+        cpr, cdr: annual prepayment and default rates, scalar or one per period
+        horizon: number of projected periods, defaults to the longest maturity
+        chunk: number of loans projected at a time
+        """
+        mat = np.asarray(mat, dtype = np.int64)
+        pv = np.asarray(pv, dtype = np.float64)
+        r = np.asarray(r, dtype = np.float64)
+        if horizon is None:
+            horizon = int(mat.max())
+        chunks = ((mat[i:i+chunk], pv[i:i+chunk], r[i:i+chunk]) for i in range(0, len(mat), chunk))
+        return self.cpt_cashflow_stream(chunks, horizon, cpr = cpr, cdr = cdr)
+
+    def cpt_cashflow_stream(self, chunks, horizon, cpr = 0, cdr = 0):
+        """
+        same as cpt_cashflow, for loans streamed as an iterable of
+        (mat, pv, r) array chunks so the whole pool never sits in memory
+        """
+        bal = np.zeros(horizon + 1)
+        rbal = np.zeros(horizon + 1)
+        for mat, pv, r in chunks:
+            b, rb = _pool_balance(mat, pv, r, horizon)
+            bal += b
+            rbal += rb
+        smm = 1 - np.power(1 - np.broadcast_to(np.asarray(cpr, dtype = np.float64), (horizon,)), 1./self.freq)
+        mdr = 1 - np.power(1 - np.broadcast_to(np.asarray(cdr, dtype = np.float64), (horizon,)), 1./self.freq)
+        surv = np.cumprod((1 - mdr)*(1 - smm))
+        prev = np.concatenate(([1.], surv[:-1]))
+        perf = prev*(1 - mdr)
+        df = pd.DataFrame({
+            'begin_balance': bal[:-1]*prev,
+            'interest': rbal[:-1]*perf,
+            'sched_principal': (bal[:-1] - bal[1:])*perf,
+            'prepayment': bal[1:]*perf*smm,
+            'default': bal[:-1]*prev*mdr,
+            'end_balance': bal[1:]*surv,
+            }, columns = POOL_LABEL)
+        self.cf = df
+        return self.cf
+
 class Bond(Annuity):
     def __init__(self, freq = 2, par = 100):
         self.freq = freq
@@ -163,6 +230,24 @@ class Bond(Annuity):
         cpv = _pv(fv = self.par, _y = ra, n = mata)
         return (pfv + self.par, ppv + cpv)
 
+    def cpt_price_batch(self, mat, cp, r, frac = 0):
+        """
+        price a book of bonds in one broadcast pass, one row per bond
+        does not write any state onto the instance
+
+        Parameters
+        ----------
+        mat: years to maturity counted from the last coupon date
+        cp: annual coupon amounts
+        r: annual yields to maturity
+        frac: fraction of the current coupon period elapsed at settlement
+
+        returns
+        -------
+        clean, dirty: arrays of clean and dirty (full) prices
+        """
+        return _bond_price(mat = mat, cp = cp, r = r, freq = self.freq, par = self.par, frac = frac)
+
 def _ear(nom_rate, num_comp = 1, cc = False):
     """
     effective annual rate
@@ -226,3 +311,85 @@ def _a1gs(r, s, n = 0, series = False):
 
 def _ngs(r, s, a1 = 1):
     return np.log(1 - s*(1-r)/a1) / np.log(r)
+
+def _balance(pv, pmt, r, k):
+    """
+    balance of a level-payment loan after k payments
+    """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        paid = np.where(r == 0, pmt*k, _sumgs(r = 1+r, n = k, a1 = pmt))
+    return _fv(pv = pv, _y = r, n = k) - paid
+
+def _pmt(pv, r, n):
+    """
+    level payment of a loan, vectorized and safe for zero rates
+    """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(r == 0, pv/n, _a1gs(r = 1/(1+r), s = pv*(1+r), n = n))
+
+def _pool_balance(mat, pv, r, horizon):
+    """
+    sum over loans of scheduled balances, and of rate-weighted balances,
+    at periods 0..horizon; balances are zero from maturity on
+    """
+    mat = np.asarray(mat, dtype = np.int64)[:, np.newaxis]
+    pv = np.asarray(pv, dtype = np.float64)[:, np.newaxis]
+    r = np.asarray(r, dtype = np.float64)[:, np.newaxis]
+    k = np.arange(horizon + 1)[np.newaxis, :]
+    b = np.where(k < mat, _balance(pv = pv, pmt = _pmt(pv = pv, r = r, n = mat), r = r, k = k), 0.)
+    return b.sum(axis = 0), np.dot(r[:, 0], b)
+
+def _amt(pv, pmt, r, n):
+    """
+    closed-form amortization schedules of level-payment loans
+
+    end balance after k payments:
+    B_k = pv*(1+r)^k - pmt*((1+r)^k - 1)/r
+    the rounding residual of each loan is absorbed by its last payment
+
+    returns
+    -------
+    structured array, one row per loan period, with fields
+    loan, period and AMT_LABEL
+    """
+    pv, pmt, r = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype = np.float64)) for v in (pv, pmt, r)])
+    n = np.broadcast_to(np.asarray(n, dtype = np.int64), pv.shape)
+    loan = np.repeat(np.arange(len(pv)), n)
+    last = np.cumsum(n) - 1
+    period = np.arange(len(loan)) - np.repeat(last + 1 - n, n)
+    pv, pmt, r = pv[loan], pmt[loan], r[loan]
+    begin = _balance(pv = pv, pmt = pmt, r = r, k = period)
+    interest = begin*r
+    principal = pmt - interest
+    end = begin - principal
+    dtype = [('loan', np.int64), ('period', np.int64)] + [(k, np.float64) for k in AMT_LABEL]
+    sched = np.empty(len(loan), dtype = dtype)
+    sched['loan'] = loan
+    sched['period'] = period
+    for k, col in zip(AMT_LABEL, (begin, pmt, interest, principal, end)):
+        sched[k] = col
+    err = sched['end_balance'][last]
+    sched['payment'][last] += err
+    sched['principal'][last] += err
+    sched['end_balance'][last] -= err
+    return sched
+
+def _bond_price(mat, cp, r, freq = 2, par = 100, frac = 0):
+    """
+    vectorized clean and dirty bond prices
+
+    dirty = (pv of coupon annuity + pv of par) carried forward by frac periods
+    clean = dirty - accrued interest, accrued = frac * coupon per period
+    zero yields fall back to the undiscounted sum of cash flows
+    """
+    freq = float(freq)
+    n = np.asarray(mat, dtype = np.float64) * freq
+    cpa = np.asarray(cp, dtype = np.float64) / freq
+    ra = np.asarray(r, dtype = np.float64) / freq
+    frac = np.asarray(frac, dtype = np.float64)
+    v = 1/(1+ra)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        apv = np.where(ra == 0, cpa*n, _sumgs(r = v, n = n, a1 = cpa*v))
+    dirty = _fv(pv = apv + _pv(fv = par, _y = ra, n = n), _y = ra, n = frac)
+    clean = dirty - frac*cpa
+    return clean, dirty